@@ -1,53 +1,133 @@
-from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, request, Response
+import orjson
 import threading
-from collections import defaultdict
+
+import numpy as np
+from sortedcontainers import SortedList
 
 app = Flask(__name__)
 
+
+def json_response(payload):
+    """Serialize a response payload with orjson instead of Flask's jsonify."""
+    return Response(orjson.dumps(payload), mimetype="application/json")
+
+
+def parse_hhmm(time_str):
+    """Convert HH:MM time format to minutes since midnight.
+
+    Pure integer arithmetic on the digit characters; avoids the cost of a
+    full datetime.strptime parse on every request.
+    """
+    return ((ord(time_str[0]) - 48) * 10 + (ord(time_str[1]) - 48)) * 60 \
+        + (ord(time_str[3]) - 48) * 10 + (ord(time_str[4]) - 48)
+
+
+# Precomputed HH:MM strings for every minute of the day (plus "24:00" for
+# appointments ending exactly at midnight), so converting minutes back to a
+# time string is a single tuple lookup
+_HHMM = tuple(f"{m // 60:02d}:{m % 60:02d}" for m in range(1441))
+
+
 # Dictionary to store provider details
 providers = {}
 
-# Dictionary to store scheduled appointments
+# Dictionary to store scheduled appointments, guarded by appt_lock for writes.
+# Writers bump appointments_version under the lock so readers can snapshot
+# speculatively and retry instead of taking the lock themselves.
 appointments = {}
+appt_lock = threading.Lock()
+appointments_version = 0
+
+# Striped locks for concurrency control: providers hash onto a fixed pool of
+# shards, so the lock table itself needs no synchronization to grow
+LOCK_SHARDS = [threading.Lock() for _ in range(64)]
+
+
+def plock(provider_id):
+    """Return the lock shard guarding the given provider."""
+    return LOCK_SHARDS[hash(provider_id) & 63]
+
+
+class PrioIndex:
+    """Priority index of providers ordered by available slots, most first.
+
+    Entries are (-available_slots, id(provider), provider) tuples in a
+    SortedList, so the best provider lookup is O(log P) instead of a full
+    scan. All mutations happen under a single short-lived lock, which makes
+    updates safe across request threads regardless of which provider lock
+    the caller holds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = SortedList()
+
+    def add(self, provider):
+        with self._lock:
+            self._entries.add((-provider.available_slots, id(provider), provider))
 
-# Mapping of available slots to providers for prioritization
-availability_map = defaultdict(list)
+    def update(self, provider, old_slots, new_slots):
+        """Reposition a provider after its available slot count changed."""
+        if new_slots == old_slots:
+            return
+        with self._lock:
+            self._entries.discard((-old_slots, id(provider), provider))
+            if new_slots > 0:
+                self._entries.add((-new_slots, id(provider), provider))
 
-# Provider-specific locks to ensure concurrency control
-provider_locks = defaultdict(threading.Lock)
+    def iter_candidates(self, chunk=8):
+        """Yield providers best-first, copying out a small chunk at a time.
+
+        Most requests are satisfied by the first few candidates, so this
+        avoids duplicating the whole index per request. Concurrent updates
+        may shift entries between chunk fetches, which is no worse than
+        iterating a stale full copy.
+        """
+        pos = 0
+        while True:
+            with self._lock:
+                entries = list(self._entries[pos:pos + chunk])
+            if not entries:
+                return
+            for _, _, provider in entries:
+                yield provider
+            pos += len(entries)
+
+
+# Priority index mapping available slots to providers for prioritization
+prio = PrioIndex()
 
 
 class Provider:
     def __init__(self, provider_id, availability, max_daily_appointments):
         self.id = provider_id
-        # Convert availability time to minutes and sort slots by start time
-        self.availability = sorted(
-            [(self._convert_to_minutes(slot['start']), self._convert_to_minutes(slot['end']))
+        # Convert availability time to minutes, kept ordered by start time
+        self.availability = SortedList(
+            [(parse_hhmm(slot['start']), parse_hhmm(slot['end']))
              for slot in availability], key=lambda x: x[0]
         )
         self.max_daily_appointments = max_daily_appointments
-        self.scheduled_appointments = []
+        # request_id -> (start, end), so cancellation is an O(1) pop
+        self.scheduled_appointments = {}
         self.available_slots = max_daily_appointments
 
-        # Insert provider into availability map based on available slots
+        # Insert provider into the priority index based on available slots
         if self.available_slots > 0:
-            availability_map[self.available_slots].append(self)
-
-    def _convert_to_minutes(self, time_str):
-        """Convert HH:MM time format to minutes since midnight."""
-        t = datetime.strptime(time_str, "%H:%M")
-        return t.hour * 60 + t.minute
-
-    def _convert_from_minutes(self, minutes):
-        """Convert minutes since midnight back to HH:MM format."""
-        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+            prio.add(self)
 
     def find_least_fragmenting_slot(self, duration, preferred_start, preferred_end):
         """Finds an available slot that minimizes fragmentation."""
-        for i, (slot_start, slot_end) in enumerate(self.availability):
-            if slot_end <= preferred_start or slot_start >= preferred_end:
-                continue
+        # Slots are disjoint and ordered by start, so the only candidate
+        # before preferred_start is the slot straddling it; bisect there
+        # instead of scanning every slot that ends too early.
+        availability = self.availability
+        first = availability.bisect_key_left(preferred_start)
+        if first > 0 and availability[first - 1][1] > preferred_start:
+            first -= 1
+        for slot_start, slot_end in availability.islice(first):
+            if slot_start >= preferred_end:
+                break
             adjusted_start = max(slot_start, preferred_start)
             adjusted_end = min(slot_end, preferred_end)
             if adjusted_end - adjusted_start < duration:
@@ -55,132 +135,193 @@ class Provider:
             left_fragment = adjusted_start - slot_start
             right_fragment = slot_end - adjusted_end
             proposed_start = adjusted_start if left_fragment <= right_fragment else adjusted_end - duration
-            return proposed_start, i
-        return None, -1
+            return proposed_start, (slot_start, slot_end)
+        return None, None
 
-    def schedule(self, request_id, start_time, duration, slot_index):
+    def schedule(self, request_id, start_time, duration, slot):
         """Schedules an appointment and updates availability slots."""
         if self.available_slots == 0:
             return None
 
-        # Add appointment to scheduled list
-        self.scheduled_appointments.append((request_id, start_time, start_time + duration))
+        # Add appointment to scheduled mapping
+        self.scheduled_appointments[request_id] = (start_time, start_time + duration)
         self.available_slots -= 1
 
         # Update availability slots
-        slot_start, slot_end = self.availability[slot_index]
-        new_slots = []
+        slot_start, slot_end = slot
+        self.availability.remove(slot)
         if slot_start < start_time:
-            new_slots.append((slot_start, start_time))
+            self.availability.add((slot_start, start_time))
         if start_time + duration < slot_end:
-            new_slots.append((start_time + duration, slot_end))
-        self.availability[slot_index:slot_index + 1] = new_slots
+            self.availability.add((start_time + duration, slot_end))
 
-        # Update provider prioritization in availability map
-        availability_map[self.available_slots + 1].remove(self)
-        if self.available_slots > 0:
-            availability_map[self.available_slots].insert(0, self)
+        # Update provider prioritization in the priority index
+        prio.update(self, self.available_slots + 1, self.available_slots)
 
         return {
             "request_id": request_id,
             "provider_id": self.id,
             "time_slot": {
-                "start": self._convert_from_minutes(start_time),
-                "end": self._convert_from_minutes(start_time + duration)
+                "start": _HHMM[start_time],
+                "end": _HHMM[start_time + duration]
             }
         }
 
+    def try_schedule(self, request_id, duration, preferred_start, preferred_end):
+        """Find the least-fragmenting slot and schedule into it in one pass.
+
+        Single entry point for the hot scheduling pipeline: callers make one
+        method call per provider, and the capacity check runs before the slot
+        search so exhausted providers cost nothing. Returns the appointment
+        payload, or None if the provider can't take the request.
+        """
+        if self.available_slots == 0:
+            return None
+        start_time, slot = self.find_least_fragmenting_slot(duration, preferred_start, preferred_end)
+        if slot is None:
+            return None
+        return self.schedule(request_id, start_time, duration, slot)
+
     def update_scheduled_appointments(self, to_cancel):
         """Removes canceled appointments and updates available slots."""
-        self.scheduled_appointments = [(req_id, start, end) for req_id, start, end in self.scheduled_appointments if req_id not in to_cancel]
+        for req_id in to_cancel:
+            self.scheduled_appointments.pop(req_id, None)
+        old_slots = self.available_slots
         self.available_slots = self.max_daily_appointments - len(self.scheduled_appointments)
+        prio.update(self, old_slots, self.available_slots)
 
 
 @app.route("/providers", methods=["POST"])
 def add_provider():
     """Registers a new provider with their availability and max daily appointments."""
-    data = request.json
+    data = orjson.loads(request.get_data())
     provider_id = data['id']
-    with provider_locks[provider_id]:
+    with plock(provider_id):
         providers[provider_id] = Provider(provider_id, data['availability'], data['max_daily_appointments'])
-    return jsonify({"message": "Provider added successfully."})
+    return json_response({"message": "Provider added successfully."})
 
 
 @app.route("/appointments", methods=["POST"])
 def schedule_appointment():
     """Schedules an appointment for a user, considering provider preferences and availability."""
-    data = request.json
+    global appointments_version
+    data = orjson.loads(request.get_data())
     request_id = data['id']
     duration = data['duration']
 
     # Convert preferred time range to minutes
-    preferred_start = datetime.strptime(data['preferred_range']['start'], "%H:%M").hour * 60 + datetime.strptime(data['preferred_range']['start'], "%H:%M").minute
-    preferred_end = datetime.strptime(data['preferred_range']['end'], "%H:%M").hour * 60 + datetime.strptime(data['preferred_range']['end'], "%H:%M").minute
+    preferred_range = data['preferred_range']
+    preferred_start = parse_hhmm(preferred_range['start'])
+    preferred_end = parse_hhmm(preferred_range['end'])
     preferred_provider = data.get("preferred_provider")
 
     # Check if user has a provider preference
     if preferred_provider:
-        if preferred_provider not in providers:
-            return jsonify({"error": "Preferred provider not available"})
-
-        with provider_locks[preferred_provider]:
-            provider = providers[preferred_provider]
-            start_time, slot_index = provider.find_least_fragmenting_slot(duration, preferred_start, preferred_end)
-            if slot_index != -1:
-                appointment = provider.schedule(request_id, start_time, duration, slot_index)
-                if appointment:
+        # Resolve the provider outside the lock; providers are never removed,
+        # so the lookup doesn't need to happen in the critical section.
+        provider = providers.get(preferred_provider)
+        if provider is None:
+            return json_response({"error": "Preferred provider not available"})
+
+        with plock(preferred_provider):
+            appointment = provider.try_schedule(request_id, duration, preferred_start, preferred_end)
+            if appointment:
+                # Publish before releasing the provider lock: the availability
+                # PUT relies on every request in scheduled_appointments
+                # already being present in appointments when it cancels.
+                with appt_lock:
                     appointments[request_id] = appointment
-                    return jsonify(appointment)
-            return jsonify({"error": "No available time slot within preferred range for the selected provider."})
-
-    # If no preferred provider, prioritize providers with more available slots
-    available_slots_copy = sorted(availability_map.keys(), reverse=True)  # Iterate in descending order
-    for available_slots in available_slots_copy:
-        providers_copy = list(availability_map[available_slots])  # Make a copy to avoid modification issues
-        for provider in providers_copy:
-            with provider_locks[provider.id]:
-                start_time, slot_index = provider.find_least_fragmenting_slot(duration, preferred_start, preferred_end)
-                if slot_index != -1:
-                    appointment = provider.schedule(request_id, start_time, duration, slot_index)
-                    if appointment:
-                        appointments[request_id] = appointment
-                        return jsonify(appointment)
+                    appointments_version += 1
+        if appointment:
+            return json_response(appointment)
+        return json_response({"error": "No available time slot within preferred range for the selected provider."})
+
+    # If no preferred provider, prioritize providers with more available
+    # slots. Acquire locks non-blocking so one contended provider doesn't
+    # stall the request when other candidates are free.
+    for provider in prio.iter_candidates():
+        lock = plock(provider.id)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            appointment = provider.try_schedule(request_id, duration, preferred_start, preferred_end)
+            if appointment:
+                # Publish before releasing the provider lock: the availability
+                # PUT relies on every request in scheduled_appointments
+                # already being present in appointments when it cancels.
+                with appt_lock:
+                    appointments[request_id] = appointment
+                    appointments_version += 1
+        finally:
+            lock.release()
+        if appointment:
+            return json_response(appointment)
 
-    return jsonify({"error": "No available time slot within preferred range."})
+    return json_response({"error": "No available time slot within preferred range."})
 
 
 @app.route("/providers/<provider_id>/availability", methods=["PUT"])
 def update_provider_availability(provider_id):
     """Updates provider availability and cancels conflicting appointments."""
-    if provider_id not in providers:
-        return jsonify({"error": "Provider not found."})
-
-    data = request.json
-    with provider_locks[provider_id]:
+    global appointments_version
+    # Resolve the provider outside the lock; providers are never removed,
+    # so the lookup doesn't need to happen in the critical section.
+    provider = providers.get(provider_id)
+    if provider is None:
+        return json_response({"error": "Provider not found."})
+
+    data = orjson.loads(request.get_data())
+    with plock(provider_id):
         # Convert new availability times to minutes
-        providers[provider_id].availability = sorted(
-            [(providers[provider_id]._convert_to_minutes(slot['start']), providers[provider_id]._convert_to_minutes(slot['end']))
+        provider.availability = SortedList(
+            [(parse_hhmm(slot['start']), parse_hhmm(slot['end']))
              for slot in data['availability']], key=lambda x: x[0]
         )
 
-        # Identify appointments that need to be canceled
-        to_cancel = [req_id for req_id, start, end in providers[provider_id].scheduled_appointments
-                     if not any(slot_start <= start and end <= slot_end for slot_start, slot_end in providers[provider_id].availability)]
+        # Identify appointments that need to be canceled. Since slots are
+        # disjoint and ordered by start, the only slot that can contain an
+        # appointment is the last one starting at or before it; a vectorized
+        # searchsorted finds that slot for every appointment at once.
+        availability = provider.availability
+        scheduled = provider.scheduled_appointments
+        to_cancel = set()
+        if scheduled:
+            if availability:
+                req_ids = list(scheduled)
+                bounds = np.array(list(scheduled.values()), dtype=np.int32)
+                slots = np.array(availability, dtype=np.int32)
+                idx = np.searchsorted(slots[:, 0], bounds[:, 0], side='right') - 1
+                contained = (idx >= 0) & (bounds[:, 1] <= slots[np.maximum(idx, 0), 1])
+                to_cancel = {req_id for req_id, ok in zip(req_ids, contained) if not ok}
+            else:
+                to_cancel = set(scheduled)
 
         # Update appointments status
-        for req_id in to_cancel:
-            appointments[req_id]['status'] = "Cancelled"
+        with appt_lock:
+            for req_id in to_cancel:
+                appointments[req_id]['status'] = "Cancelled"
+            appointments_version += 1
 
-        providers[provider_id].update_scheduled_appointments(to_cancel)
+        provider.update_scheduled_appointments(to_cancel)
 
-    return jsonify({"message": "Availability updated, affected appointments cancelled."})
+    return json_response({"message": "Availability updated, affected appointments cancelled."})
 
 
 @app.route("/appointments", methods=["GET"])
 def get_appointments():
     """Returns a list of all scheduled appointments."""
-    return jsonify({"scheduled": list(appointments.values())})
+    # Speculative lock-free read: snapshot, then re-check the version and
+    # retry if a writer slipped in. Retries are rare under read-heavy load.
+    while True:
+        v1 = appointments_version
+        snapshot = list(appointments.values())
+        if appointments_version == v1:
+            return json_response({"scheduled": snapshot})
 
 
 if __name__ == "__main__":
-    app.run(debug=True, threaded=True)  # Enable multi-threading to handle parallel requests
+    # Convenience entrypoint for local development only; in production run
+    # under a real WSGI server. State is process-local, so use a single
+    # worker process and scale with threads:
+    #   gunicorn -w 1 -k gthread --threads 32 app:app
+    app.run(threaded=True)